@@ -1,10 +1,37 @@
 import argparse
 import pathlib
 from PIL import Image
+import numpy as np
 import os
 import sys
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+
+# Leading sprite number of a file name, and the separator that follows it.
+_SPRITE_ORDER_RE = re.compile(r'^(\d+)')
+_LEADING_NUM_RE = re.compile(r'^\d+[\s_-]*')
+
+# Messages for stdout are queued on args.log for each run and written in one go when it finishes,
+# unless --verbose is set.
+def log(args, message):
+    """
+    Queues a message for stdout, or prints it straight away in verbose mode.
+    """
+    if args.verbose:
+        print(message)
+    else:
+        args.log.append(message)
+
+def flush_log(args):
+    """
+    Writes every queued message to stdout in a single call.
+    """
+    if len(args.log) > 0:
+        sys.stdout.write("\n".join(args.log) + "\n")
+        args.log.clear()
 
 def get_args():
     description = "Generates a sprite sheet using all sprites provided. It is recommended that all sprites are equally sized."
@@ -36,62 +63,95 @@ def get_args():
                         default=(0,0),
                         help="padding to apply for all sprites")
     
+    parser.add_argument("--verbose",
+                        action="store_true",
+                        help="print progress messages as they happen instead of all at once when finished.")
+    
     # Maybe other arguments for mesh optimization later on.
     return parser.parse_args()
 
 
-def stitch_images(images, grid_size, padding=(0,0)):
+def check_grid_capacity(sprite_count, grid_size):
     """
-    Stitches all the images provided into one image.
+    Makes sure the grid has a cell for every sprite.
 
     Parameters:
-        images (list[PIL.Image.Image]): The path to the image file.
-        grid_size (tuple): A tuple (row, col) representing the rows and columns of the stitched image.
-        padding (tuple): A tuple (x, y) representing the padding between each image.
+        sprite_count (int): The number of sprites that will be placed on the sheet.
+        grid_size (tuple): A tuple (row, col) representing the rows and columns of the sheet.
 
-    Returns:
-        stitched_immage (PIL.Image.Image): The stitched image.
+    Raises:
+        ValueError: If there are more sprites than grid cells.
     """
-    
-    # Get the width and height of all images
-    widths, heights = zip(*(img.size for img in images))
+    rows, cols = grid_size
+    if sprite_count > rows * cols:
+        raise ValueError("The number of images exceeds the provided grid size")
+
 
+def create_canvas(sprite_size, grid_size, padding=(0,0)):
+    """
+    Allocates a blank sprite sheet canvas with a cell for every grid position.
+
+    Parameters:
+        sprite_size (tuple): A tuple (width, height) representing the size of each grid cell.
+        grid_size (tuple): A tuple (row, col) representing the rows and columns of the sheet.
+        padding (tuple): A tuple (x, y) representing the padding between each sprite.
+
+    Returns:
+        canvas (numpy.ndarray): A transparent (height, width, 4) RGBA buffer.
+    """
     # Get number of rows and columns for the grid
     rows, cols = grid_size
 
-    # Make sure we have enough images to fill the grid
-    if len(images) > rows * cols:
-        raise ValueError("The number of images exceeds the provided grid size")
+    # Calculate the total width and height for the output image
+    total_width = cols * sprite_size[0] + (cols - 1) * padding[0]
+    total_height = rows * sprite_size[1] + (rows - 1) * padding[1]
 
-    # Get max sprite size
-    max_width = max(widths)
-    max_height = max(heights)
+    # Create a blank RGBA canvas to preserve transparency
+    return np.zeros((total_height, total_width, 4), dtype=np.uint8)
 
-    # Calculate the total width and height for the output image
-    total_width = cols * max_width + (cols - 1) * padding[0]
-    total_height = rows * max_height + (rows - 1) * padding[1]
 
-    # Create a new blank image with RGBA mode to preserve transparency
-    stitched_image = Image.new('RGBA', (total_width, total_height), (0,0,0,0))
+def paste_sprite(canvas, sprite, index, sprite_size, grid_size, padding=(0,0)):
+    """
+    Copies the pixels of a sprite into its grid cell on the canvas.
 
-    # Iterate over the images and paste them into the grid
-    for idx, img in enumerate(images):
-        # Calculate the position in the grid
-        row = idx // cols
-        col = idx % cols
+    Parameters:
+        canvas (numpy.ndarray): The RGBA canvas created by create_canvas.
+        sprite (numpy.ndarray): The (height, width, 4) RGBA pixels of the sprite.
+        index (int): The position of the sprite on the sheet, counted row by row.
+        sprite_size (tuple): A tuple (width, height) representing the size of each grid cell.
+        grid_size (tuple): A tuple (row, col) representing the rows and columns of the sheet.
+        padding (tuple): A tuple (x, y) representing the padding between each sprite.
+    """
+    # Calculate the position in the grid
+    cols = grid_size[1]
+    row = index // cols
+    col = index % cols
 
-        # Calculate the x and y position for this image
-        x_offset = col * (max_width + padding[0])
-        y_offset = row * (max_height + padding[1])
+    # Calculate the x and y position for this image
+    x_offset = col * (sprite_size[0] + padding[0])
+    y_offset = row * (sprite_size[1] + padding[1])
 
-        # Paste the image at the correct position
-        stitched_image.paste(img, (x_offset, y_offset))
+    canvas[y_offset:y_offset + sprite.shape[0], x_offset:x_offset + sprite.shape[1]] = sprite
 
-    # Create metadata
-    metadata = {
+
+def create_metadata(sheet, sprite_size, grid_size, padding=(0,0)):
+    """
+    Creates the metadata describing the layout of a sprite sheet.
+
+    Parameters:
+        sheet (PIL.Image.Image): The stitched sprite sheet.
+        sprite_size (tuple): A tuple (width, height) representing the size of each grid cell.
+        grid_size (tuple): A tuple (row, col) representing the rows and columns of the sheet.
+        padding (tuple): A tuple (x, y) representing the padding between each sprite.
+
+    Returns:
+        metadata (dict): The sprite sheet metadata.
+    """
+    rows, cols = grid_size
+    return {
         "sprite_size": {
-            "width": max_width,
-            "height": max_height
+            "width": sprite_size[0],
+            "height": sprite_size[1]
         },
         "sprite_padding": {
             "horizontal": padding[0],
@@ -102,17 +162,89 @@ def stitch_images(images, grid_size, padding=(0,0)):
             "cols": cols
         },
         "sheet_size": {
-            "width": stitched_image.width,
-            "height": stitched_image.height
+            "width": sheet.width,
+            "height": sheet.height
         },
     }
+
+
+def stitch_images(images, grid_size, padding=(0,0)):
+    """
+    Stitches all the images provided into one image.
+
+    Parameters:
+        images (list[PIL.Image.Image]): The path to the image file.
+        grid_size (tuple): A tuple (row, col) representing the rows and columns of the stitched image.
+        padding (tuple): A tuple (x, y) representing the padding between each image.
+
+    Returns:
+        stitched_immage (PIL.Image.Image): The stitched image.
+    """
+    
+    # Get max sprite size in a single pass
+    max_width = 0
+    max_height = 0
+    for img in images:
+        max_width = max(max_width, img.width)
+        max_height = max(max_height, img.height)
+    sprite_size = (max_width, max_height)
+
+    # Make sure we have enough cells for every image
+    check_grid_capacity(len(images), grid_size)
+    canvas = create_canvas(sprite_size, grid_size, padding)
+
+    # Iterate over the images and copy them into the grid
+    for idx, img in enumerate(images):
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        paste_sprite(canvas, np.asarray(img), idx, sprite_size, grid_size, padding)
+
+    stitched_image = Image.fromarray(canvas, "RGBA")
+    metadata = create_metadata(stitched_image, sprite_size, grid_size, padding)
         
     return stitched_image, metadata
 
 
-def command_validation(args):
+def get_sprite_order(file_name):
+    match = _SPRITE_ORDER_RE.match(file_name)
+    if match:
+        return int(match.group(1))
+    else:
+        # No number at the start, push to the bottom
+        return float('inf')
+
+def get_sprite_files(path):
+    """
+    Lists every sprite file under a path in sheet order.
+
+    Parameters:
+        path (pathlib.Path): A sprite file or a folder of sprites.
+
+    Returns:
+        sprite_files (list[str]): The file paths, with folders expanded depth first and
+            ordered by their leading sprite number, then by name.
     """
-    Validates arguments provided through the command line.
+    sprite_files = []
+
+    # Walk directories with an explicit stack instead of recursion. Children are pushed in
+    # reverse so they are popped in sprite order.
+    stack = [path]
+    while stack:
+        entry = stack.pop()
+        if entry.is_dir():
+            with os.scandir(entry) as children:
+                # Sort on the name as well so ties don't depend on the file system's listing order.
+                children = sorted(children, key=lambda child: (get_sprite_order(child.name), child.name))
+            stack.extend(reversed(children))
+        else:
+            sprite_files.append(os.fspath(entry))
+
+    return sprite_files
+
+def process_arguments(args):
+    """
+    Validates arguments provided through the command line and collects every sprite in a single pass.
+    Stores a (path, (width, height), label) tuple for each sprite file in args.sprites.
     """
     invalid_files = []
     # Verify that the inputs exist
@@ -122,67 +254,105 @@ def command_validation(args):
     
     if len(invalid_files) > 0:
         return f"Error: These files do not exist: {', '.join(invalid_files)}"
-    
+
+    sprites = []
+    for input in args.input:
+        for path in get_sprite_files(input):
+            # Only read the header here, sprites are decoded one at a time when stitching.
+            try:
+                with Image.open(path) as image:
+                    size = image.size
+            except (OSError, SyntaxError, ValueError, Image.UnidentifiedImageError):
+                # Only a failing input file aborts, failures inside directories are skipped.
+                if path == os.fspath(input):
+                    return f"Error: image '{path}' failed to load."
+                log(args, f"Image '{path}' failed to load.")
+                continue
+
+            # Process name
+            label = _LEADING_NUM_RE.sub('', os.path.splitext(os.path.basename(path))[0])
+            if len(label) == 0:
+                label = None
+            sprites.append((path, size, label))
+    args.sprites = sprites
+
     return None
 
-def get_sprite_order(file_name):
-    match = re.match(r'^(\d+)', file_name)
-    if match:
-        return int(match.group(1))
-    else:
-        # No number at the start, push to the bottom
-        return float('inf')
+def decode_sprite(path):
+    """
+    Decodes a sprite file into RGBA pixels.
 
-def main():
-    args = get_args()
-    error_message = command_validation(args)
+    Parameters:
+        path (str): The path to the sprite file.
+
+    Returns:
+        sprite (numpy.ndarray): The (height, width, 4) RGBA pixels of the sprite.
+    """
+    # load() decodes the whole file and raises if it is corrupt.
+    with Image.open(path) as image:
+        image.load()
+        # Sprites are usually RGBA already, only convert other modes.
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        return np.asarray(image)
+
+def run(args):
+    """
+    Generates a sprite sheet from the command line arguments.
+    """
+    error_message = process_arguments(args)
     if error_message is not None:
         print(error_message, file=sys.stderr)
         return
 
-    images = []
-    labels = []
-
-    def process_path(path):
-        if path.is_dir():
-            dir_list = os.listdir(path)
-            dir_list = sorted(dir_list, key=get_sprite_order)
-            for child in dir_list:
-                process_path(pathlib.Path(os.path.join(path, child)))
-        else:
-            # Open image and add to sheet
-            # @TODO: Load each image one at a time with "lazy loading" to minimize peak memory usage.
-            try:
-                # Verify file
-                image = Image.open(path)
-                image.verify()
-                image.close()
-
-                # Process name and add to list
-                processed_name = pathlib.Path(path.name).stem
-                processed_name = re.sub(r'^\d+[\s_-]*', '', processed_name)
-                if len(processed_name) == 0:
-                    processed_name = None
-                labels.append(processed_name)
-
-                # Reopen Image
-                image = Image.open(path)
-                images.append(image.convert("RGBA"))
-                image.close()
-            except:
-                print(f"Image '{path}' failed to load.")
-                return False
-        return True
-
-    for path in args.input:
-        if not process_path(path):
-            return
+    sprite_paths = [path for path, _, _ in args.sprites]
+    sprite_sizes = [size for _, size, _ in args.sprites]
+    labels = [label for _, _, label in args.sprites]
 
     sprite_padding = args.sprite_padding
     grid_size = args.grid_size
 
-    # Produce sprite sheet
-    sheet, metadata = stitch_images(images, grid_size, sprite_padding)
+    # Get max sprite size
+    sprite_size = (
+        max((width for width, _ in sprite_sizes), default=0),
+        max((height for _, height in sprite_sizes), default=0)
+    )
+
+    # Produce sprite sheet, releasing each decoded sprite once it is on the canvas
+    canvas = create_canvas(sprite_size, grid_size, sprite_padding)
+
+    # Sprites are decoded in parallel since zlib releases the GIL, while pasting stays on this thread.
+    # At most 2 * max_workers decodes are queued ahead of the sprite being pasted, which caps how many
+    # decoded sprites are held in memory at once.
+    input_paths = {os.fspath(path) for path in args.input}
+    max_workers = os.cpu_count() or 1
+    sheet_labels = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending_paths = iter(sprite_paths)
+        decode_jobs = deque(executor.submit(decode_sprite, path) for path in islice(pending_paths, 2 * max_workers))
+        for path, label in zip(sprite_paths, labels):
+            job = decode_jobs.popleft()
+            for next_path in islice(pending_paths, 1):
+                decode_jobs.append(executor.submit(decode_sprite, next_path))
+            try:
+                sprite = job.result()
+            except (OSError, SyntaxError, ValueError, Image.UnidentifiedImageError):
+                # Same rule as process_arguments, only a failing input file aborts.
+                if path in input_paths:
+                    print(f"Error: image '{path}' failed to load.", file=sys.stderr)
+                    return
+                # Sprites inside directories are dropped along with their label.
+                log(args, f"Image '{path}' failed to load.")
+                continue
+
+            # Only sprites that decoded take up a cell.
+            check_grid_capacity(len(sheet_labels) + 1, grid_size)
+            paste_sprite(canvas, sprite, len(sheet_labels), sprite_size, grid_size, sprite_padding)
+            sheet_labels.append(label)
+    labels = sheet_labels
+
+    sheet = Image.fromarray(canvas, "RGBA")
+    metadata = create_metadata(sheet, sprite_size, grid_size, sprite_padding)
 
     # Save sprite sheet
     output_path = args.output.with_suffix('')
@@ -191,23 +361,26 @@ def main():
 
     try: 
         with open(str(output_path) + "-metadata.json", 'w') as file:
-                json.dump(metadata, file, indent=4)
+                json.dump(metadata, file)
     except:
-        print("failed to save sprite data")
+        log(args, "failed to save sprite data")
 
     sheet.save(output_path.with_suffix('.png'), format="PNG")
 
-    # Clean up
-    for image in images:
-        image.close()
-
+    # Write every label in a single call, unlabelled sprites are left as empty lines.
     with open(str(output_path) + "-labels.txt", 'w') as label_file:
-        for label in labels:
-            if label is None:
-                label = ""
-            label_file.write(f"{label}\n")
+        label_file.write("".join(f"{label or ''}\n" for label in labels))
+
+    log(args, "done.")
 
-    print("done.")
+
+def main():
+    args = get_args()
+    args.log = []
+    try:
+        run(args)
+    finally:
+        flush_log(args)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,38 @@
 import argparse
 import pathlib
 from PIL import Image
+import numpy as np
 import os
 import sys
 import shutil
 import json
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional libspng based PNG encoder, installed through the pyspng-seunglab package.
+try:
+    import pyspng
+except ImportError:
+    pyspng = None
+
+# Messages for stdout are queued on args.log for each run and written in one go when it finishes,
+# unless --verbose is set.
+def log(args, message):
+    """
+    Queues a message for stdout, or prints it straight away in verbose mode.
+    """
+    if args.verbose:
+        print(message)
+    else:
+        args.log.append(message)
+
+def flush_log(args):
+    """
+    Writes every queued message to stdout in a single call.
+    """
+    if len(args.log) > 0:
+        sys.stdout.write("\n".join(args.log) + "\n")
+        args.log.clear()
 
 def get_args():
     description = "Splits all sprites in a sprite sheet into their own files."
@@ -59,6 +87,22 @@ def get_args():
                         action="store_true",
                         help="determines whether blank sprites should be disincluded.")
     
+    parser.add_argument("--compress_level",
+                        type=int,
+                        default=1,
+                        choices=range(10),
+                        help="PNG compression level of each sprite, from 0 (fastest) to 9 (smallest). Defaults to 1.")
+    
+    parser.add_argument("--png_encoder",
+                        type=str,
+                        default="pillow",
+                        choices=["pillow", "pyspng"],
+                        help="library used to encode each sprite. pyspng requires the pyspng-seunglab package. Defaults to pillow.")
+    
+    parser.add_argument("--verbose",
+                        action="store_true",
+                        help="print progress messages as they happen instead of all at once when finished.")
+    
     return parser.parse_args()
 
 
@@ -86,21 +130,52 @@ def get_image_section(image, position, size):
     
     return cropped_img
 
+def _split_no_pad(sheet, sprite_width, sprite_height):
+    """
+    Splits an unpadded RGBA sheet array into sprites.
+    """
+    # Without padding the sheet is a plain grid, so a single reshape lays every sprite out contiguously.
+    image_height, image_width = sheet.shape[:2]
+    rows = image_height // sprite_height
+    cols = image_width // sprite_width
+    grid = sheet[:rows * sprite_height, :cols * sprite_width]
+    tiles = np.ascontiguousarray(grid.reshape(rows, sprite_height, cols, sprite_width, 4).transpose(0, 2, 1, 3, 4))
+    return [Image.fromarray(tile, "RGBA") for row in tiles for tile in row]
+
+def _split_pad(sheet, sprite_width, sprite_height, padding_x, padding_y):
+    """
+    Splits a padded RGBA sheet array into sprites.
+    """
+    image_height, image_width = sheet.shape[:2]
+    images = []
+    for y in range(0, image_height - sprite_height + 1, sprite_height + padding_y):
+        for x in range(0, image_width - sprite_width + 1, sprite_width + padding_x):
+            images.append(Image.fromarray(sheet[y:y + sprite_height, x:x + sprite_width], "RGBA"))
+    return images
+
 def split_sprite_sheet(image, size, padding=(0, 0)):
-    sprite_width, sprite_height = size
-    padding_x, padding_y = padding
+    """
+    Splits a sprite sheet into its individual sprites.
 
-    images = []
+    Parameters:
+        image (PIL.Image.Image): The sprite sheet image.
+        size (tuple): A tuple (width, height) representing the size of each sprite.
+        padding (tuple): A tuple (x, y) representing the padding between each sprite.
 
-    image_width, image_height = image.size
+    Returns:
+        images (list[PIL.Image.Image]): The RGBA sprites, ordered row by row.
+    """
+    sprite_width, sprite_height = size
+    padding_x, padding_y = padding
 
-    for y in range(0, image_height - sprite_height + 1, sprite_height + padding_y):
-        for x in range(0, image_width - sprite_width + 1, sprite_width + padding_x):
-            box = (x, y, x + sprite_width, y + sprite_height)
-            cropped_img = image.crop(box)
-            images.append(cropped_img)
+    # Convert the sheet to an array once instead of cropping it per sprite
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    sheet = np.asarray(image)
 
-    return images
+    if padding_x == 0 and padding_y == 0:
+        return _split_no_pad(sheet, sprite_width, sprite_height)
+    return _split_pad(sheet, sprite_width, sprite_height, padding_x, padding_y)
 
 
 def image_is_blank(image):
@@ -113,10 +188,29 @@ def image_is_blank(image):
     Returns:
         is_blank (bool): Whether the image is blank or not.
     """
-    # @TODO: Handle off scale that RGBA isnt used.
-    alpha_channel = image.getchannel("A")
-    alpha_values = list(alpha_channel.getdata())
-    return all(alpha == 0 for alpha in alpha_values)
+    # Images without an alpha band become fully opaque once converted.
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    # getbbox scans the alpha band in C and returns None when no pixel is visible.
+    return image.getbbox(alpha_only=True) is None
+
+def save_sprite(sprite, save_path, compress_level=1, encoder="pillow"):
+    """
+    Saves a sprite as a PNG file and closes it.
+
+    Parameters:
+        sprite (PIL.Image.Image): The sprite image.
+        save_path (str): The path of the output file.
+        compress_level (int): The zlib compression level, from 0 to 9.
+        encoder (str): The PNG encoder to use, either "pillow" or "pyspng".
+    """
+    if encoder == "pyspng":
+        with open(save_path, 'wb') as file:
+            file.write(pyspng.encode(np.asarray(sprite), compress_level=compress_level))
+    else:
+        sprite.save(save_path, format="PNG", compress_level=compress_level)
+    sprite.close()
 
 def process_arguments(args):
     """
@@ -134,19 +228,19 @@ def process_arguments(args):
     if not args.ignore_metadata:
         metadata_file = args.input.with_name(args.input.stem + "-metadata.json")
         if metadata_file.exists():
-            print("Found attached metadata.")
+            log(args, "Found attached metadata.")
             with open(metadata_file, 'r') as file:
                 data = json.load(file)
             
             if args.sprite_size is None:
                 args.sprite_size = (data["sprite_size"]["width"], data["sprite_size"]["height"])
-                print(f"sprite_size overrided by metadata to {args.sprite_size}")
+                log(args, f"sprite_size overrided by metadata to {args.sprite_size}")
             if args.sprite_padding is None:
                 args.sprite_padding = (data["sprite_padding"]["horizontal"], data["sprite_padding"]["vertical"])
-                print(f"sprite_padding overrided by metadata to {args.sprite_padding}")
+                log(args, f"sprite_padding overrided by metadata to {args.sprite_padding}")
             if args.label_path is None and "labels" in data:
                 args.labels = data["labels"]
-                print(f"labels were overrided by metadata.")
+                log(args, f"labels were overrided by metadata.")
 
     
     # Check if either metadata or sprite size are provided.
@@ -157,26 +251,38 @@ def process_arguments(args):
     if args.sprite_padding is None:
         args.sprite_padding = (0,0)
 
+    if args.png_encoder == "pyspng" and pyspng is None:
+        return "Error: the pyspng encoder requires the pyspng-seunglab package to be installed."
+
     # Verify that the inputs exist
     if not args.input.exists():
         return f"Error: sprite sheet file {args.input} does not exist!"
     return None
 
 
-def main():
-    args = get_args()
+def run(args):
+    """
+    Splits a sprite sheet using the command line arguments.
+    """
     error_message = process_arguments(args)
     if error_message is not None:
         print(error_message, file=sys.stderr)
         return
     
-    # Open image
+    # Open image, decoding straight from a memory map of the file instead of buffered reads.
     try:
-        with Image.open(args.input) as image:
-            image = image.convert("RGBA")
-    except:
-        print("Image failed to load.")
+        with open(args.input, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            image = Image.open(mapped_file)
+            image.load()
+    except (OSError, SyntaxError, ValueError, Image.UnidentifiedImageError):
+        log(args, "Image failed to load.")
         return
+
+    # Sheets made by the generator are already RGBA, only convert other modes.
+    if image.mode != "RGBA":
+        rgba_image = image.convert("RGBA")
+        image.close()
+        image = rgba_image
     
     sprite_size = args.sprite_size
     sprite_padding = args.sprite_padding
@@ -201,8 +307,9 @@ def main():
 
         # If there is a number mismatch, warn the user.
         if len(labels) != len(sprites):
-            print(f"[ WARNING ]  label count does not match sprite count. ({len(labels)} != {len(sprites)})")
+            log(args, f"[ WARNING ]  label count does not match sprite count. ({len(labels)} != {len(sprites)})")
 
+        sprite_files = []
         for i,sprite in enumerate(sprites):
             if args.disinclude_blank_sprites and image_is_blank(sprite):
                 continue
@@ -213,18 +320,28 @@ def main():
             else:
                 file_name = str(i+1)
 
-            # Save sprite file
-            save_path = os.path.join(args.output, f"{file_name}.png")
-            sprite.save(save_path, format="PNG")
+            sprite_files.append((sprite, os.path.join(args.output, f"{file_name}.png")))
 
-            # Close the image
-            sprite.close()
+        # Save sprite files in parallel, PNG encoding releases the GIL.
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            save_jobs = [executor.submit(save_sprite, sprite, save_path, args.compress_level, args.png_encoder) for sprite, save_path in sprite_files]
+            for job in save_jobs:
+                job.result()
 
     else:
-        print("sheet is smaller than input sprite size.")
+        log(args, "sheet is smaller than input sprite size.")
 
     image.close()
-    print("done.")
+    log(args, "done.")
+
+def main():
+    args = get_args()
+    args.log = []
+    try:
+        run(args)
+    finally:
+        flush_log(args)
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
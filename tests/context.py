@@ -0,0 +1,12 @@
+"""
+makes the sprite sheet tools importable by the tests, adjusting sys.path once per process
+"""
+import pathlib
+import sys
+
+ROOT_DIRECTORY = str(pathlib.Path(__file__).resolve().parent.parent)
+if ROOT_DIRECTORY not in sys.path:
+    sys.path.insert(0, ROOT_DIRECTORY)
+
+import sprite_sheet_generator
+import sprite_sheet_splitter
@@ -2,14 +2,15 @@
 tests for the sprite sheet generator
 """
 import unittest
-import pathlib
-from PIL import Image
-import sys
+import argparse
 import os
+import shutil
+import json
+import pathlib
+import tempfile
+from PIL import Image, ImageChops
 
-
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import sprite_sheet_generator
+from context import sprite_sheet_generator
 
 
 def test_existance(file_path):
@@ -23,24 +24,32 @@ def test_existance(file_path):
     if not file_path.exists():
         raise ValueError(f"Test cannot be run as data file {str(file_path)} doesn't exist!")
     
+def as_rgba(image):
+    """
+    convert an image to RGBA, returning it untouched if it already is
+    Args:
+        image (PIL.Image.Image)
+    Returns:
+        (PIL.Image.Image)
+    """
+    return image if image.mode == "RGBA" else image.convert("RGBA")
+
 def images_are_equal(image1, image2):
     # Check if the images have the same size
     if image1.size != image2.size:
         return False
 
-    # Check if the images have the same mode
+    # Images in the same mode are compared as they are, otherwise normalize both to RGBA
     if image1.mode != image2.mode:
-        return False
-
-    # Normalize both images to RGBA for consistent comparison
-    image1 = image1.convert("RGBA")
-    image2 = image2.convert("RGBA")
-
-    # Compare bytes
-    if image1.tobytes() != image2.tobytes():
-        return False
+        image1 = as_rgba(image1)
+        image2 = as_rgba(image2)
 
-    return True
+    # Compare pixels in Pillow's C core, the images are equal if no band of the difference rises above 0
+    difference = ImageChops.difference(image1, image2)
+    extrema = difference.getextrema()
+    if len(difference.getbands()) == 1:
+        extrema = (extrema,)
+    return all(high == 0 for _, high in extrema)
 
 def test_metadata(self, metadata, expected_sheet_size, grid_size, padding, sprite_size):
     self.assertEqual(
@@ -129,8 +138,8 @@ class TestSpriteSheetGenerator(unittest.TestCase):
 
         self.assertTrue(
             images_are_equal(
-                sprite_sheet.convert("RGBA"),
-                self.sprite_sheet_2x2.convert("RGBA")
+                as_rgba(sprite_sheet),
+                as_rgba(self.sprite_sheet_2x2)
             ),
             msg="sprite_sheet_split.test_sprite_sheet_gen1 (Resulting sprite sheet is not equal.)"
             )
@@ -154,8 +163,8 @@ class TestSpriteSheetGenerator(unittest.TestCase):
 
         self.assertTrue(
             images_are_equal(
-                sprite_sheet.convert("RGBA"),
-                self.sprite_sheet_2x2_padded.convert("RGBA")
+                as_rgba(sprite_sheet),
+                as_rgba(self.sprite_sheet_2x2_padded)
             ),
             msg="sprite_sheet_split.test_sprite_sheet_gen2 (Resulting sprite sheet is not equal.)"
             )
@@ -180,8 +189,8 @@ class TestSpriteSheetGenerator(unittest.TestCase):
         
         self.assertTrue(
             images_are_equal(
-                sprite_sheet.convert("RGBA"),
-                self.sprite_sheet_4x1.convert("RGBA")
+                as_rgba(sprite_sheet),
+                as_rgba(self.sprite_sheet_4x1)
             ),
             msg="sprite_sheet_split.test_sprite_sheet_gen3 (Resulting sprite sheet is not equal.)"
             )
@@ -206,8 +215,8 @@ class TestSpriteSheetGenerator(unittest.TestCase):
         
         self.assertTrue(
             images_are_equal(
-                sprite_sheet.convert("RGBA"),
-                self.sprite_sheet_4x1_padded.convert("RGBA")
+                as_rgba(sprite_sheet),
+                as_rgba(self.sprite_sheet_4x1_padded)
             ),
             msg="sprite_sheet_split.test_sprite_sheet_gen4 (Resulting sprite sheet is not equal.)"
             )
@@ -215,4 +224,136 @@ class TestSpriteSheetGenerator(unittest.TestCase):
         # Metadata check
         test_metadata(self, metadata, expected_sheet_size, grid_size, padding, sprite_size)
 
-        
\ No newline at end of file
+        
+
+    def test_sprite_file_order(self):
+        """
+        test that sprite files are ordered by their leading number then name, with folders expanded depth first.
+        """
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            root.joinpath("3 folder").mkdir()
+            for name in ("2_b.png", "2_a.png", "b.png", "a.png", "1.png", "3 folder/2.png", "3 folder/1.png", "4.png"):
+                root.joinpath(name).touch()
+
+            expected_order = ["1.png", "2_a.png", "2_b.png", "3 folder/1.png", "3 folder/2.png", "4.png", "a.png", "b.png"]
+            sprite_files = sprite_sheet_generator.get_sprite_files(root)
+
+            self.assertEqual(
+                [os.fspath(root.joinpath(name)) for name in expected_order],
+                sprite_files,
+                msg="sprite_sheet_split.test_sprite_file_order (Sprite files were not returned in the expected order.)"
+                )
+
+            single_file = root.joinpath("2_a.png")
+            self.assertEqual(
+                [os.fspath(single_file)],
+                sprite_sheet_generator.get_sprite_files(single_file),
+                msg="sprite_sheet_split.test_sprite_file_order (Single file input was not returned unchanged.)"
+                )
+
+    def test_process_arguments(self):
+        """
+        test that process_arguments collects sprite sizes and labels, skipping bad files inside folders.
+        """
+        data_directory = pathlib.Path(__file__).resolve().parent.joinpath("data")
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            for i, name in enumerate(("1_red.png", "2 blue.png", "3.png"), start=1):
+                shutil.copy(data_directory.joinpath(f"sprite_entry_{i}.png"), root.joinpath(name))
+            bad_file = root.joinpath("4_broken.png")
+            bad_file.write_bytes(b"not a png")
+
+            args = argparse.Namespace(input=[root], verbose=False, log=[])
+            self.assertIsNone(
+                sprite_sheet_generator.process_arguments(args),
+                msg="sprite_sheet_split.test_process_arguments (A bad file inside a folder should not abort.)"
+                )
+            self.assertEqual(
+                [f"Image '{bad_file}' failed to load."],
+                args.log,
+                msg="sprite_sheet_split.test_process_arguments (Skipped file was not reported.)"
+                )
+
+            expected_sprites = [
+                (os.fspath(root.joinpath("1_red.png")), self.sprites[0].size, "red"),
+                (os.fspath(root.joinpath("2 blue.png")), self.sprites[1].size, "blue"),
+                (os.fspath(root.joinpath("3.png")), self.sprites[2].size, None),
+            ]
+            self.assertEqual(expected_sprites, args.sprites, msg="sprite_sheet_split.test_process_arguments (Sprite entries did not match.)")
+
+            error = sprite_sheet_generator.process_arguments(argparse.Namespace(input=[bad_file], verbose=False, log=[]))
+            self.assertEqual(
+                f"Error: image '{bad_file}' failed to load.",
+                error,
+                msg="sprite_sheet_split.test_process_arguments (A bad input file should return an error.)"
+                )
+
+            error = sprite_sheet_generator.process_arguments(argparse.Namespace(input=[root.joinpath("missing.png")], verbose=False, log=[]))
+            self.assertTrue(
+                error.startswith("Error: These files do not exist:"),
+                msg="sprite_sheet_split.test_process_arguments (A missing input file should return an error.)"
+                )
+
+    def check_generated_sheet(self, test_name, broken_files=()):
+        """
+        run the generator on a folder holding copies of the test sprites and check everything it writes.
+        Args:
+            test_name (str): the name of the calling test, used in failure messages
+            broken_files (tuple[str]): names of sprites in the folder that fail to decode
+        """
+        data_directory = pathlib.Path(__file__).resolve().parent.joinpath("data")
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            input_directory = root.joinpath("sprites")
+            input_directory.mkdir()
+            for i in range(1, 5):
+                shutil.copy(data_directory.joinpath(f"sprite_entry_{i}.png"), input_directory.joinpath(f"{i}_sprite {i}.png"))
+            # Keep the header so the sprite passes the size check but fails once decoded.
+            truncated_bytes = data_directory.joinpath("sprite_entry_1.png").read_bytes()[:300]
+            for name in broken_files:
+                input_directory.joinpath(name).write_bytes(truncated_bytes)
+
+            args = argparse.Namespace(
+                input=[input_directory],
+                output=root.joinpath("sheet.png"),
+                grid_size=(2,2),
+                sprite_padding=(0,0),
+                verbose=False,
+                log=[]
+                )
+            sprite_sheet_generator.run(args)
+
+            expected_log = [f"Image '{input_directory.joinpath(name)}' failed to load." for name in broken_files] + ["done."]
+            self.assertEqual(expected_log, args.log, msg=f"sprite_sheet_split.{test_name} (Logged messages did not match.)")
+
+            with Image.open(root.joinpath("sheet.png")) as sprite_sheet:
+                self.assertTrue(
+                    images_are_equal(as_rgba(sprite_sheet), as_rgba(self.sprite_sheet_2x2)),
+                    msg=f"sprite_sheet_split.{test_name} (Resulting sprite sheet is not equal.)"
+                    )
+
+            expected_labels = [f"sprite {i}" for i in range(1, 5)]
+            with open(root.joinpath("sheet-labels.txt"), 'r') as label_file:
+                self.assertEqual(
+                    "".join(f"{label}\n" for label in expected_labels),
+                    label_file.read(),
+                    msg=f"sprite_sheet_split.{test_name} (Label file did not match.)"
+                    )
+
+            with open(root.joinpath("sheet-metadata.json"), 'r') as metadata_file:
+                metadata = json.load(metadata_file)
+            test_metadata(self, metadata, (100,100), (2,2), (0,0), self.sprites[0].size)
+            self.assertEqual(expected_labels, metadata["labels"], msg=f"sprite_sheet_split.{test_name} (Metadata labels did not match.)")
+
+    def test_run1(self):
+        """
+        test generating a sprite sheet through run, as the command line does.
+        """
+        self.check_generated_sheet("test_run1")
+
+    def test_run2(self):
+        """
+        test generating a sprite sheet through run when a sprite in the folder fails to decode. The sprite should be dropped without taking a cell.
+        """
+        self.check_generated_sheet("test_run2", broken_files=("5_broken.png",))
@@ -2,15 +2,29 @@
 tests for the sprite sheet splitter
 """
 import unittest
+import io
+import argparse
+import json
 import pathlib
+import tempfile
 from PIL import Image
 from PIL.Image import Transpose
-import sys
-import os
+import numpy as np
+import xxhash
 
+from context import sprite_sheet_splitter
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-import sprite_sheet_splitter
+DATA_DIRECTORY = pathlib.Path(__file__).resolve().parent.joinpath("data")
+
+# Sheet fixture and padding of each split scenario. Every sheet holds the same four sprites.
+SPLIT_CASES = [
+    ("sprite_sheet_2x2_rgba", (0,0)),
+    ("sprite_sheet_2x2_padded_rgba", (20,20)),
+    ("sprite_sheet_4x1_rgba", (0,0)),
+    ("sprite_sheet_4x1_padded_rgba", (10,10)),
+    ("sprite_sheet_1x4_rgba", (0,0)),
+    ("sprite_sheet_1x4_padded_rgba", (10,10)),
+]
 
 
 def test_existance(file_path):
@@ -24,216 +38,340 @@ def test_existance(file_path):
     if not file_path.exists():
         raise ValueError(f"Test cannot be run as data file {str(file_path)} doesn't exist!")
     
-def images_are_equal(image1, image2):
-    # Check if the images have the same size
-    if image1.size != image2.size:
-        return False
-
-    # Check if the images have the same mode
-    if image1.mode != image2.mode:
-        return False
+def as_rgba(image):
+    """
+    convert an image to RGBA, returning it untouched if it already is
+    Args:
+        image (PIL.Image.Image)
+    Returns:
+        (PIL.Image.Image)
+    """
+    return image if image.mode == "RGBA" else image.convert("RGBA")
 
-    # Normalize both images to RGBA for consistent comparison
-    image1 = image1.convert("RGBA")
-    image2 = image2.convert("RGBA")
+def array_hash(array):
+    """
+    hash the dtype, shape and pixels of an array
+    Args:
+        array (numpy.ndarray)
+    Returns:
+        (bytes) 16 byte digest
+    """
+    digest = xxhash.xxh3_128()
+    digest.update(f"{array.dtype} {array.shape}".encode())
+    digest.update(array)
+    return digest.digest()
 
-    # Compare bytes
-    if image1.tobytes() != image2.tobytes():
-        return False
+def stack_images(images):
+    """
+    stack the RGBA pixels of images vertically so they can be compared in a single check
+    Args:
+        images (list[PIL.Image.Image]) images of equal width
+    Returns:
+        (numpy.ndarray)
+    """
+    return np.concatenate([np.asarray(as_rgba(image)) for image in images], axis=0)
 
-    return True
+def split_args(input_path, output_path, **options):
+    """
+    build the arguments the splitter command line would parse, using its defaults
+    Args:
+        input_path (pathlib.Path) the sprite sheet file
+        output_path (pathlib.Path) the output folder
+        options: arguments that replace the defaults
+    Returns:
+        (argparse.Namespace)
+    """
+    args = argparse.Namespace(
+        input=input_path,
+        output=output_path,
+        sprite_size=None,
+        sprite_padding=None,
+        label_path=None,
+        file_name_separator=" ",
+        clear_directory=False,
+        ignore_metadata=False,
+        disinclude_blank_sprites=False,
+        compress_level=1,
+        png_encoder="pillow",
+        verbose=False,
+        log=[]
+        )
+    for name, value in options.items():
+        setattr(args, name, value)
+    return args
+
+def load_image(file_name):
+    """
+    open and decode an image from the test data directory
+    Args:
+        file_name (str)
+    Returns:
+        (PIL.Image.Image)
+    """
+    path = DATA_DIRECTORY.joinpath(file_name)
+    test_existance(path)
+    # Read the whole file in one call and decode from memory, so no file handle stays open
+    image = Image.open(io.BytesIO(path.read_bytes()))
+    image.load()
+    return image
 
 class TestSpriteSheetSplitter(unittest.TestCase):
     """
     tests of sprite sheet splitter
     """
 
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         """
-        build a full test class
+        build a full test class. Fixtures are read only, so they are shared by every test and only
+        loaded the first time a test uses them
         """
-        data_directory = pathlib.Path(__file__).resolve().parent.joinpath("data")
+        cls.fixtures = {}
 
-        path = data_directory.joinpath("blank_image.png")
-        test_existance(path)
-        self.blank_image = Image.open(path)
+    @classmethod
+    def tearDownClass(cls):
+        """
+        clean up
+        """
+        for fixture in cls.fixtures.values():
+            images = fixture if isinstance(fixture, list) else [fixture]
+            for image in images:
+                if isinstance(image, Image.Image):
+                    image.close()
+
+    @classmethod
+    def fixture(cls, name, loader):
+        """
+        get a fixture, calling loader to build it on first use
+        """
+        if name not in cls.fixtures:
+            cls.fixtures[name] = loader()
+        return cls.fixtures[name]
 
-        path = data_directory.joinpath("non_blank_image.png")
-        test_existance(path)
-        self.non_blank_image = Image.open(path)
+    @property
+    def blank_image_rgba(self):
+        return self.fixture("blank_image_rgba", lambda: as_rgba(load_image("blank_image.png")))
 
-        path = data_directory.joinpath("2x2_sprite_sheet.png")
-        test_existance(path)
-        self.sprite_sheet_2x2 = Image.open(path)
+    @property
+    def non_blank_image_rgba(self):
+        return self.fixture("non_blank_image_rgba", lambda: as_rgba(load_image("non_blank_image.png")))
 
-        path = data_directory.joinpath("2x2_sprite_sheet_padded_20.png")
-        test_existance(path)
-        self.sprite_sheet_2x2_padded = Image.open(path)
+    @property
+    def sprite_sheet_2x2_rgba(self):
+        return self.fixture("sprite_sheet_2x2_rgba", lambda: as_rgba(load_image("2x2_sprite_sheet.png")))
 
-        path = data_directory.joinpath("4x1_sprite_sheet.png")
-        test_existance(path)
-        self.sprite_sheet_4x1 = Image.open(path)
+    @property
+    def sprite_sheet_2x2_padded_rgba(self):
+        return self.fixture("sprite_sheet_2x2_padded_rgba", lambda: as_rgba(load_image("2x2_sprite_sheet_padded_20.png")))
 
-        path = data_directory.joinpath("4x1_sprite_sheet_padded_10.png")
-        test_existance(path)
-        self.sprite_sheet_4x1_padded = Image.open(path)
+    @property
+    def sprite_sheet_4x1_rgba(self):
+        return self.fixture("sprite_sheet_4x1_rgba", lambda: as_rgba(load_image("4x1_sprite_sheet.png")))
 
-        sprites = []
-        for i in range(1,5):
-            path = data_directory.joinpath(f"sprite_entry_{i}.png")
-            test_existance(path)
-            sprites.append(Image.open(path))
-        self.sprites = sprites
-        
+    @property
+    def sprite_sheet_4x1_padded_rgba(self):
+        return self.fixture("sprite_sheet_4x1_padded_rgba", lambda: as_rgba(load_image("4x1_sprite_sheet_padded_10.png")))
 
-    def tearDown(self):
-        """
-        clean up
-        """
-        self.non_blank_image.close()
-        self.blank_image.close()
-        self.sprite_sheet_2x2.close()
-        self.sprite_sheet_2x2_padded.close()
-        for sprite in self.sprites:
-            sprite.close()
+    @property
+    def sprite_sheet_1x4_rgba(self):
+        return self.fixture("sprite_sheet_1x4_rgba", lambda: self.sprite_sheet_4x1_rgba.transpose(Transpose.TRANSPOSE))
+
+    @property
+    def sprite_sheet_1x4_padded_rgba(self):
+        return self.fixture("sprite_sheet_1x4_padded_rgba", lambda: self.sprite_sheet_4x1_padded_rgba.transpose(Transpose.TRANSPOSE))
+
+    @property
+    def sprites_rgba(self):
+        return self.fixture("sprites_rgba", lambda: [as_rgba(load_image(f"sprite_entry_{i}.png")) for i in range(1,5)])
+
+    @property
+    def sprites_hash(self):
+        # Hash the stacked reference sprites once, each split result is then checked against a 16 byte digest
+        return self.fixture("sprites_hash", lambda: array_hash(stack_images(self.sprites_rgba)))
 
     def test_blank_check1(self):
         """
         test checking if image is blank. This should result in blank.
         """
-        prediction = sprite_sheet_splitter.image_is_blank(self.blank_image.convert('RGBA'))
+        prediction = sprite_sheet_splitter.image_is_blank(self.blank_image_rgba)
         self.assertTrue(prediction, msg="sprite_sheet_split.test_blank_check1 (Image is actually blank.)")
 
     def test_blank_check2(self):
         """
         test checking if image is blank. This should result in non blank.
         """
-        prediction = sprite_sheet_splitter.image_is_blank(self.non_blank_image.convert('RGBA'))
+        prediction = sprite_sheet_splitter.image_is_blank(self.non_blank_image_rgba)
         self.assertFalse(prediction, msg="sprite_sheet_split.test_blank_check2 (Image is not actually blank.)")
 
-    def test_sprite_sheet_split1(self):
+    def test_blank_check3(self):
         """
-        test checking if image can be split properly.
+        test checking if image is blank. An RGB image has no transparency so this should result in non blank.
         """
-        sheet = self.sprite_sheet_2x2.convert("RGBA")
-        sprite_size = (50,50)
-        padding = (0,0)
-
-        split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
-        self.assertEqual(len(split_images), 4, msg="sprite_sheet_split.test_sprite_sheet_split1 (Did not result in four images.)")
-        self.assertTrue(sprite_size == split_images[0].size, msg="sprite_sheet_split.test_sprite_sheet_split1 (Image size does not match requirement.)")
-
-        for i in range(4):
-            self.assertTrue(
-                images_are_equal(
-                    split_images[i].convert("RGBA"),
-                    self.sprites[i].convert("RGBA")
-                ),
-            msg="sprite_sheet_split.test_sprite_sheet_split1 (Images are not equal.)"
-            )
+        with Image.new("RGB", (2, 2)) as image:
+            prediction = sprite_sheet_splitter.image_is_blank(image)
+        self.assertFalse(prediction, msg="sprite_sheet_split.test_blank_check3 (RGB image is not actually blank.)")
 
-    def test_sprite_sheet_split2(self):
+    def test_blank_check4(self):
         """
-        test checking if image can be split properly. Similar to the first, but with padding.
+        test checking if image is blank. Colour with zero alpha is invisible so this should result in blank.
         """
-        sheet = self.sprite_sheet_2x2_padded.convert("RGBA")
-        sprite_size = (50,50)
-        padding = (20, 20)
-
-        split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
-        self.assertEqual(len(split_images), 4, msg="sprite_sheet_split.test_sprite_sheet_split2 (Did not result in four images.)")
-        self.assertTrue(sprite_size == split_images[0].size, msg="sprite_sheet_split.test_sprite_sheet_split2 (Image size mismatch.)")
-
-        for i in range(4):
-            self.assertTrue(
-                images_are_equal(
-                    split_images[i].convert("RGBA"),
-                    self.sprites[i].convert("RGBA")
-                ),
-            msg="sprite_sheet_split.test_sprite_sheet_split2 (Images are not equal.)"
+        with Image.new("RGBA", (2, 2), (255, 0, 0, 0)) as image:
+            prediction = sprite_sheet_splitter.image_is_blank(image)
+        self.assertTrue(prediction, msg="sprite_sheet_split.test_blank_check4 (Fully transparent image is actually blank.)")
+
+    def check_saved_sprite(self, encoder, test_name):
+        """
+        save a sprite with the given encoder and check the written pixels match.
+        Args:
+            encoder (str): the PNG encoder passed to save_sprite
+            test_name (str): the name of the calling test, used in failure messages
+        """
+        sprite = self.sprites_rgba[0]
+        with tempfile.TemporaryDirectory() as temp_directory:
+            save_path = pathlib.Path(temp_directory).joinpath("sprite.png")
+            # save_sprite closes the sprite, so hand it a copy of the cached fixture.
+            sprite_sheet_splitter.save_sprite(sprite.copy(), save_path, compress_level=6, encoder=encoder)
+            with Image.open(save_path) as saved:
+                saved_pixels = np.asarray(as_rgba(saved))
+        self.assertTrue(
+            np.array_equal(np.asarray(sprite), saved_pixels),
+            msg=f"sprite_sheet_split.{test_name} (Saved sprite does not match.)"
             )
 
+    def test_save_sprite_pillow(self):
+        """
+        test saving a sprite with the Pillow encoder.
+        """
+        self.check_saved_sprite("pillow", "test_save_sprite_pillow")
 
-    def test_sprite_sheet_split3(self):
+    @unittest.skipUnless(sprite_sheet_splitter.pyspng, "pyspng-seunglab is not installed")
+    def test_save_sprite_pyspng(self):
         """
-        test checking if image can be split properly. This time with a 4x1 sprite sheet.
+        test saving a sprite with the pyspng encoder.
         """
-        sheet = self.sprite_sheet_4x1.convert("RGBA")
-        sprite_size = (50,50)
-        padding = (0,0)
-
-        split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
-        self.assertEqual(len(split_images), 4, msg="sprite_sheet_split.test_sprite_sheet_split3 (Did not result in four images.)")
-        self.assertTrue(sprite_size == split_images[0].size, msg="sprite_sheet_split.test_sprite_sheet_split3 (Image size does not match requirement.)")
-
-        for i in range(4):
-            self.assertTrue(
-                images_are_equal(
-                    split_images[i].convert("RGBA"),
-                    self.sprites[i].convert("RGBA")
-                ),
-            msg="sprite_sheet_split.test_sprite_sheet_split3 (Images are not equal.)"
-            )
+        self.check_saved_sprite("pyspng", "test_save_sprite_pyspng")
 
-    def test_sprite_sheet_split4(self):
+    def test_sprite_sheet_split(self):
         """
-        test checking if image can be split properly. This time with a 4x1 sprite sheet, but with padding.
+        test checking if image can be split properly, for every sheet layout with and without padding.
         """
-        sheet = self.sprite_sheet_4x1_padded.convert("RGBA")
         sprite_size = (50,50)
-        padding = (10,10)
-
-        split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
-        self.assertEqual(len(split_images), 4, msg="sprite_sheet_split.test_sprite_sheet_split4 (Did not result in four images.)")
-        self.assertTrue(sprite_size == split_images[0].size, msg="sprite_sheet_split.test_sprite_sheet_split4 (Image size does not match requirement.)")
-
-        for i in range(4):
-            self.assertTrue(
-                images_are_equal(
-                    split_images[i].convert("RGBA"),
-                    self.sprites[i].convert("RGBA")
-                ),
-            msg="sprite_sheet_split.test_sprite_sheet_split4 (Images are not equal.)"
-            )
 
-    def test_sprite_sheet_split5(self):
+        for sheet_name, padding in SPLIT_CASES:
+            with self.subTest(sheet=sheet_name, padding=padding):
+                sheet = getattr(self, sheet_name)
+
+                split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
+                self.assertEqual(len(split_images), 4, msg=f"sprite_sheet_split.test_sprite_sheet_split {sheet_name} (Did not result in four images.)")
+                self.assertTrue(sprite_size == split_images[0].size, msg=f"sprite_sheet_split.test_sprite_sheet_split {sheet_name} (Image size does not match requirement.)")
+
+                self.assertEqual(
+                    array_hash(stack_images(split_images)),
+                    self.sprites_hash,
+                    msg=f"sprite_sheet_split.test_sprite_sheet_split {sheet_name} (Images are not equal.)"
+                    )
+
+
+    def check_split_files(self, output_path, expected_sprites, test_name):
         """
-        test checking if image can be split properly. This time with a 1x4 sprite sheet.
+        check the files written by the splitter against the expected sprites.
+        Args:
+            output_path (pathlib.Path): the output folder of the split
+            expected_sprites (dict[str, PIL.Image.Image]): the expected RGBA sprite for each file name
+            test_name (str): the name of the calling test, used in failure messages
         """
-        sheet = self.sprite_sheet_4x1.transpose(Transpose.TRANSPOSE).convert("RGBA")
-        sprite_size = (50,50)
-        padding = (0,0)
-
-        split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
-        self.assertEqual(len(split_images), 4, msg="sprite_sheet_split.test_sprite_sheet_split5 (Did not result in four images.)")
-        self.assertTrue(sprite_size == split_images[0].size, msg="sprite_sheet_split.test_sprite_sheet_split5 (Image size does not match requirement.)")
-
-        for i in range(4):
-            self.assertTrue(
-                images_are_equal(
-                    split_images[i].convert("RGBA"),
-                    self.sprites[i].convert("RGBA")
-                ),
-            msg="sprite_sheet_split.test_sprite_sheet_split5 (Images are not equal.)"
+        self.assertEqual(
+            sorted(expected_sprites),
+            sorted(path.name for path in output_path.iterdir()),
+            msg=f"sprite_sheet_split.{test_name} (Sprite file names did not match.)"
+            )
+        saved_sprites = []
+        for name in expected_sprites:
+            with Image.open(output_path.joinpath(name)) as saved:
+                # as_rgba hands back RGBA images untouched, so copy them out before the file closes.
+                saved_sprites.append(as_rgba(saved).copy())
+        self.assertEqual(
+            array_hash(stack_images(saved_sprites)),
+            array_hash(stack_images(list(expected_sprites.values()))),
+            msg=f"sprite_sheet_split.{test_name} (Saved sprites are not equal.)"
             )
 
-    def test_sprite_sheet_split6(self):
+    def test_run1(self):
         """
-        test checking if image can be split properly. This time with a 1x4 sprite sheet, but with padding.
+        test splitting a sprite sheet through run, taking the sprite size and labels from its metadata.
         """
-        sheet = self.sprite_sheet_4x1_padded.transpose(Transpose.TRANSPOSE).convert("RGBA")
-        sprite_size = (50,50)
-        padding = (10,10)
-
-        split_images = sprite_sheet_splitter.split_sprite_sheet(sheet, sprite_size, padding)
-        self.assertEqual(len(split_images), 4, msg="sprite_sheet_split.test_sprite_sheet_split6 (Did not result in four images.)")
-        self.assertTrue(sprite_size == split_images[0].size, msg="sprite_sheet_split.test_sprite_sheet_split6 (Image size does not match requirement.)")
-
-        for i in range(4):
-            self.assertTrue(
-                images_are_equal(
-                    split_images[i].convert("RGBA"),
-                    self.sprites[i].convert("RGBA")
-                ),
-            msg="sprite_sheet_split.test_sprite_sheet_split6 (Images are not equal.)"
-            )
\ No newline at end of file
+        labels = ["red", "green", "", "blue"]
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            sheet_path = root.joinpath("sheet.png")
+            self.sprite_sheet_2x2_rgba.save(sheet_path)
+            metadata = {
+                "sprite_size": {"width": 50, "height": 50},
+                "sprite_padding": {"horizontal": 0, "vertical": 0},
+                "labels": labels
+            }
+            with open(root.joinpath("sheet-metadata.json"), 'w') as metadata_file:
+                json.dump(metadata, metadata_file)
+
+            output_path = root.joinpath("sprites")
+            sprite_sheet_splitter.run(split_args(sheet_path, output_path, compress_level=9))
+
+            expected_names = ["1 red.png", "2 green.png", "3.png", "4 blue.png"]
+            self.check_split_files(output_path, dict(zip(expected_names, self.sprites_rgba)), "test_run1")
+
+    def test_run2(self):
+        """
+        test splitting a sprite sheet without an alpha band through run. Sprites should be saved as opaque RGBA.
+        """
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            sheet_path = root.joinpath("sheet.png")
+            with self.sprite_sheet_2x2_rgba.convert("RGB") as rgb_sheet:
+                rgb_sheet.save(sheet_path)
+
+            output_path = root.joinpath("sprites")
+            sprite_sheet_splitter.run(split_args(sheet_path, output_path, sprite_size=(50,50)))
+
+            expected_sprites = {f"{i}.png": as_rgba(sprite.convert("RGB")) for i, sprite in enumerate(self.sprites_rgba, start=1)}
+            self.check_split_files(output_path, expected_sprites, "test_run2")
+
+    def test_run3(self):
+        """
+        test splitting a sprite sheet with a blank cell through run while blank sprites are disincluded.
+        """
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            sheet_path = root.joinpath("sheet.png")
+            # Clear the bottom right sprite.
+            sheet = np.array(self.sprite_sheet_2x2_rgba)
+            sheet[50:, 50:] = 0
+            Image.fromarray(sheet, "RGBA").save(sheet_path)
+
+            output_path = root.joinpath("sprites")
+            sprite_sheet_splitter.run(split_args(sheet_path, output_path, sprite_size=(50,50), disinclude_blank_sprites=True))
+
+            expected_sprites = {f"{i}.png": sprite for i, sprite in enumerate(self.sprites_rgba[:3], start=1)}
+            self.check_split_files(output_path, expected_sprites, "test_run3")
+
+    def test_run4(self):
+        """
+        test splitting an empty sprite sheet file through run. Nothing should be written.
+        """
+        with tempfile.TemporaryDirectory() as temp_directory:
+            root = pathlib.Path(temp_directory)
+            sheet_path = root.joinpath("sheet.png")
+            sheet_path.touch()
+
+            output_path = root.joinpath("sprites")
+            args = split_args(sheet_path, output_path, sprite_size=(50,50))
+            sprite_sheet_splitter.run(args)
+
+            self.assertFalse(output_path.exists(), msg="sprite_sheet_split.test_run4 (An empty sheet should not be split.)")
+            self.assertEqual(["Image failed to load."], args.log, msg="sprite_sheet_split.test_run4 (Load failure was not reported.)")
+
+
+# A transparent 1x1 PNG, decoded once at import so Pillow's plugin registration and zlib setup
+# happen before any test runs instead of inside the first one.
+_TINY_PNG_BYTES = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc````\x00\x00\x00\x05\x00\x01\xa5\xf6E@\x00\x00\x00\x00IEND\xaeB`\x82'
+with Image.open(io.BytesIO(_TINY_PNG_BYTES)) as _warm_up_image:
+    _warm_up_image.load()
@@ -1,38 +1,29 @@
+import os
 import unittest
 
-from test_sheet_split import TestSpriteSheetSplitter
-from test_sheet_gen import TestSpriteSheetGenerator
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
 def make_suite():
     """
-    make a unittest TestSuite object
+    make a unittest TestSuite object from every test module in this directory
         Returns
             (unittest.TestSuite)
     """
-    suite = unittest.TestSuite()
-
-    suite.addTest(TestSpriteSheetSplitter('test_blank_check1'))
-    suite.addTest(TestSpriteSheetSplitter('test_blank_check2'))
-    suite.addTest(TestSpriteSheetSplitter('test_sprite_sheet_split1'))
-    suite.addTest(TestSpriteSheetSplitter('test_sprite_sheet_split2'))
-    suite.addTest(TestSpriteSheetSplitter('test_sprite_sheet_split3'))
-    suite.addTest(TestSpriteSheetSplitter('test_sprite_sheet_split4'))
-    suite.addTest(TestSpriteSheetSplitter('test_sprite_sheet_split5'))
-    suite.addTest(TestSpriteSheetSplitter('test_sprite_sheet_split6'))
-
-    suite.addTest(TestSpriteSheetGenerator('test_sprite_sheet_gen1'))
-    suite.addTest(TestSpriteSheetGenerator('test_sprite_sheet_gen2'))
-    suite.addTest(TestSpriteSheetGenerator('test_sprite_sheet_gen3'))
-    suite.addTest(TestSpriteSheetGenerator('test_sprite_sheet_gen4'))
-
-    return suite
+    return unittest.defaultTestLoader.discover(TESTS_DIRECTORY)
 
 def run_all_tests():
     """
-    run all tests in the TestSuite
+    run all tests in the TestSuite, spread across every core when unittest-parallel is installed
     """
-    runner = unittest.TextTestRunner()
-    runner.run(make_suite())
+    try:
+        from unittest_parallel.main import main as run_parallel
+    except ImportError:
+        runner = unittest.TextTestRunner()
+        runner.run(make_suite())
+        return
+
+    # Each worker runs a whole test class so setUpClass fixtures are only loaded once per worker
+    run_parallel(['--level', 'class', '--start-directory', TESTS_DIRECTORY])
 
 if __name__ == '__main__':
     run_all_tests()